@@ -1,7 +1,34 @@
+import contextlib
 import sqlite3
 import threading
 from datetime import datetime
 
+# 热路径SQL做成模块常量:同一str对象反复传入execute,命中sqlite3语句缓存
+_SQL_GET_SETTING = "SELECT value FROM settings WHERE key = ?"
+_SQL_SET_SETTING = """
+    INSERT OR REPLACE INTO settings (key, value, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+"""
+_SQL_ALL_GROUPS = """
+    SELECT g.id, g.name, g.order_num, g.is_nas_service,
+           s.id, s.name, s.url_public, s.url_local, s.icon, s.order_num
+    FROM groups g
+    LEFT JOIN services s ON s.group_id = g.id
+    ORDER BY g.order_num, g.id, s.order_num, s.id
+"""
+_SQL_CREATE_GROUP = """
+    INSERT INTO groups (name, order_num, is_nas_service)
+    VALUES (?, ?, ?)
+"""
+_SQL_UPDATE_GROUP = "UPDATE groups SET name = ? WHERE id = ?"
+_SQL_UPDATE_GROUP_ORDER = "UPDATE groups SET name = ?, order_num = ? WHERE id = ?"
+_SQL_DELETE_GROUP = "DELETE FROM groups WHERE id = ?"
+_SQL_CREATE_SERVICE = """
+    INSERT INTO services (group_id, name, url_public, url_local, icon, order_num)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SQL_DELETE_SERVICE = "DELETE FROM services WHERE id = ?"
+
 
 class Database:
     def __init__(self, db_path="data/dashboard.db"):
@@ -12,10 +39,22 @@ class Database:
     def _get_connection(self):
         """获取线程本地的数据库连接"""
         if not hasattr(self.local, "connection"):
-            self.local.connection = sqlite3.connect(
-                self.db_path, check_same_thread=False
+            # isolation_level=None:自动提交,多语句写入由调用方显式BEGIN
+            # 默认tuple行:按位置取列比sqlite3.Row按名取快约一倍
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=256,
             )
-            self.local.connection.row_factory = sqlite3.Row
+            # WAL下读写互不阻塞;NORMAL把每次提交的两次fsync降为一次
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-20000")
+            conn.execute("PRAGMA mmap_size=134217728")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self.local.connection = conn
         return self.local.connection
 
     def _init_db(self):
@@ -68,9 +107,17 @@ class Database:
         """
         )
 
+        # 服务按分组查询的覆盖索引,供get_all_groups的JOIN走索引扫描
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_services_group
+            ON services(group_id, order_num, id)
+        """
+        )
+
         # 检查是否存在NAS服务分组
-        cursor.execute("SELECT COUNT(*) as count FROM groups WHERE is_nas_service = 1")
-        if cursor.fetchone()["count"] == 0:
+        cursor.execute("SELECT COUNT(*) FROM groups WHERE is_nas_service = 1")
+        if cursor.fetchone()[0] == 0:
             cursor.execute(
                 """
                 INSERT INTO groups (name, order_num, is_nas_service) 
@@ -80,86 +127,75 @@ class Database:
 
         conn.commit()
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """显式事务:把多条写入合并成一次提交,fsync从N次降为1次"""
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
     def get_setting(self, key):
         """获取设置"""
         conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cursor.fetchone()
-        return row["value"] if row else None
+        row = conn.cursor().execute(_SQL_GET_SETTING, (key,)).fetchone()
+        return row[0] if row else None
 
-    def set_setting(self, key, value):
-        """设置配置"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO settings (key, value, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """,
-            (key, value),
-        )
-        conn.commit()
+    def set_setting(self, key, value, conn=None):
+        """设置配置;传入conn时加入调用方事务,不单独提交"""
+        in_transaction = conn is not None
+        if conn is None:
+            conn = self._get_connection()
+        conn.execute(_SQL_SET_SETTING, (key, value))
+        if not in_transaction:
+            conn.commit()
 
     def get_all_groups(self):
         """获取所有分组及其服务"""
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        cursor.execute(
-            """
-            SELECT id, name, order_num, is_nas_service 
-            FROM groups 
-            ORDER BY order_num, id
-        """
-        )
-        groups = []
-        for row in cursor.fetchall():
-            group = {
-                "id": row["id"],
-                "name": row["name"],
-                "order": row["order_num"],
-                "is_nas_service": bool(row["is_nas_service"]),
-                "services": [],
-            }
+        # 单条LEFT JOIN代替每个分组一次查询,避免N+1往返
+        cursor.execute(_SQL_ALL_GROUPS)
 
-            cursor.execute(
-                """
-                SELECT id, name, url_public, url_local, icon, order_num
-                FROM services
-                WHERE group_id = ?
-                ORDER BY order_num, id
-            """,
-                (row["id"],),
-            )
+        groups = []
+        current = None
+        for gid, gname, gorder, is_nas, sid, sname, url_pub, url_loc, icon, sorder in (
+            cursor.fetchall()
+        ):
+            if current is None or current["id"] != gid:
+                current = {
+                    "id": gid,
+                    "name": gname,
+                    "order": gorder,
+                    "is_nas_service": bool(is_nas),
+                    "services": [],
+                }
+                groups.append(current)
 
-            for service_row in cursor.fetchall():
-                group["services"].append(
+            if sid is not None:
+                current["services"].append(
                     {
-                        "id": service_row["id"],
-                        "name": service_row["name"],
-                        "url_public": service_row["url_public"],
-                        "url_local": service_row["url_local"],
-                        "icon": service_row["icon"],
-                        "order": service_row["order_num"],
+                        "id": sid,
+                        "name": sname,
+                        "url_public": url_pub,
+                        "url_local": url_loc,
+                        "icon": icon,
+                        "order": sorder,
                     }
                 )
 
-            groups.append(group)
-
         return groups
 
     def create_group(self, name, order=999, is_nas_service=False):
         """创建分组"""
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO groups (name, order_num, is_nas_service)
-            VALUES (?, ?, ?)
-        """,
-            (name, order, is_nas_service),
-        )
+        cursor.execute(_SQL_CREATE_GROUP, (name, order, is_nas_service))
         conn.commit()
         return cursor.lastrowid
 
@@ -168,26 +204,16 @@ class Database:
         conn = self._get_connection()
         cursor = conn.cursor()
         if order is not None:
-            cursor.execute(
-                """
-                UPDATE groups SET name = ?, order_num = ? WHERE id = ?
-            """,
-                (name, order, group_id),
-            )
+            cursor.execute(_SQL_UPDATE_GROUP_ORDER, (name, order, group_id))
         else:
-            cursor.execute(
-                """
-                UPDATE groups SET name = ? WHERE id = ?
-            """,
-                (name, group_id),
-            )
+            cursor.execute(_SQL_UPDATE_GROUP, (name, group_id))
         conn.commit()
 
     def delete_group(self, group_id):
         """删除分组"""
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM groups WHERE id = ?", (group_id,))
+        cursor.execute(_SQL_DELETE_GROUP, (group_id,))
         conn.commit()
 
     def create_service(
@@ -197,15 +223,16 @@ class Database:
         conn = self._get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            """
-            INSERT INTO services (group_id, name, url_public, url_local, icon, order_num)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """,
-            (group_id, name, url_public, url_local, icon, order),
+            _SQL_CREATE_SERVICE, (group_id, name, url_public, url_local, icon, order)
         )
         conn.commit()
         return cursor.lastrowid
 
+    def create_services_bulk(self, rows):
+        """批量创建服务,单事务内executemany一次提交"""
+        with self.transaction() as conn:
+            conn.executemany(_SQL_CREATE_SERVICE, rows)
+
     def update_service(
         self, service_id, name, url_public=None, url_local=None, icon=None, order=None
     ):
@@ -243,5 +270,5 @@ class Database:
         """删除服务"""
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM services WHERE id = ?", (service_id,))
+        cursor.execute(_SQL_DELETE_SERVICE, (service_id,))
         conn.commit()